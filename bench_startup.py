@@ -0,0 +1,79 @@
+"""Cold-start benchmark.
+
+Every stage runs in a fresh interpreter so module and file caches from
+previous runs do not leak in, except for the on-disk caches under .cache
+which are exactly what is being measured. A stage is timed from spawning
+the interpreter to its exit, so interpreter startup is included. A stage
+that fails (for example without PyQt4) leaves the cold start unmeasured
+and the run fails. Run as:
+
+    python bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+# Cold start budget for everything before the main window is shown, in ms
+STARTUP_BUDGET_MS = 400
+DEFAULT_RUNS = 5
+
+STAGES = [
+    ('interpreter', 'pass'),
+    ('import projection', 'import projection, to_sphere'),
+    ('load ellipsoids', 'import to_sphere; to_sphere.load_ellipsoids()'),
+    ('import gui', 'import gui'),
+    ('create forms', 'import sys, gui; app = gui.QApplication(sys.argv); gui.forms.MainForm(); gui.forms.GridForm()'),
+]
+
+def run_stage(code):
+    # Wall time of the whole process in ms, or the last line of its error
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=PACKAGE_PATH, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    ms = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        return None, (proc.stderr.strip().splitlines() or ['exit code {}'.format(proc.returncode)])[-1]
+    return ms, None
+
+
+def main(runs=DEFAULT_RUNS):
+    cold_start = 0.0
+    skipped = []
+    for name, code in STAGES:
+        timings = []
+        error = None
+        for _ in range(runs):
+            ms, error = run_stage(code)
+            if ms is None:
+                break
+            timings.append(ms)
+
+        if error is not None:
+            print('{:<20} skipped ({})'.format(name, error))
+            skipped.append(name)
+            continue
+
+        median = statistics.median(timings)
+        cold_start = max(cold_start, median)
+        print('{:<20} median {:8.2f} ms   min {:8.2f} ms   max {:8.2f} ms'.format(
+            name, median, min(timings), max(timings)))
+
+    if skipped:
+        print('cold start not measured, skipped: {}'.format(', '.join(skipped)))
+        return False
+
+    # Stages include each other's imports, so the slowest one is the cold start
+    verdict = 'OK' if cold_start <= STARTUP_BUDGET_MS else 'OVER BUDGET'
+    print('cold start {:.2f} ms of {} ms budget: {}'.format(cold_start, STARTUP_BUDGET_MS, verdict))
+    return cold_start <= STARTUP_BUDGET_MS
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+    sys.exit(0 if main(n) else 1)
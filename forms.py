@@ -1,19 +1,63 @@
+import importlib.util
 import os
 
-from PyQt4 import QtGui, uic
 
+FORMS_PATH = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.path.join(FORMS_PATH, '.cache', 'forms')
+FORMS = {
+    'MainForm': 'main.ui',
+    'GridForm': 'grid.ui',
+}
 
-MAIN_FORM_CLASS, _ = uic.loadUiType(os.path.join(os.path.dirname(__file__), 'main.ui'))
-GRID_FORM_CLASS, _ = uic.loadUiType(os.path.join(os.path.dirname(__file__), 'grid.ui'))
 
+def compile_form(ui_name):
+    # Generated module is rebuilt only when the .ui file is newer than it;
+    # the import machinery then keeps its bytecode in __pycache__
+    ui_path = os.path.join(FORMS_PATH, ui_name)
+    module_name = 'ui_' + os.path.splitext(ui_name)[0]
+    py_path = os.path.join(CACHE_PATH, module_name + '.py')
 
-class MainForm(QtGui.QDialog, MAIN_FORM_CLASS):
-    def __init__(self, parent=None):
-        super(MainForm, self).__init__(parent)
-        self.setupUi(self)
+    if not os.path.exists(py_path) or os.path.getmtime(py_path) < os.path.getmtime(ui_path):
+        from PyQt4 import uic
+
+        tmp_path = py_path + '.tmp'
+        try:
+            os.makedirs(CACHE_PATH, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                uic.compileUi(ui_path, f)
+            os.replace(tmp_path, py_path)
+        except OSError:
+            # Read-only install: build the class in memory as before
+            return uic.loadUiType(ui_path)[0]
+
+    spec = importlib.util.spec_from_file_location(module_name, py_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return next(getattr(module, name) for name in dir(module) if name.startswith('Ui_'))
+
+
+def make_form_class(name):
+    from PyQt4 import QtGui
 
+    ui_class = compile_form(FORMS[name])
 
-class GridForm(QtGui.QDialog, GRID_FORM_CLASS):
     def __init__(self, parent=None):
-        super(GridForm, self).__init__(parent)
+        super(form_class, self).__init__(parent)
         self.setupUi(self)
+
+    form_class = type(name, (QtGui.QDialog, ui_class), {'__init__': __init__})
+    return form_class
+
+
+def __getattr__(name):
+    # MainForm and GridForm are created on first access
+    if name not in FORMS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    form_class = make_form_class(name)
+    globals()[name] = form_class
+    return form_class
+
+
+if __name__ == '__main__':
+    for ui in FORMS.values():
+        compile_form(ui)
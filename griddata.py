@@ -0,0 +1,336 @@
+"""On-disk grid dataset for grids too fine to keep in memory.
+
+Layout of a file:
+
+    preamble   MAGIC, position and size of the index and of the header
+    data       little-endian float64 arrays, one per line, back to back
+    index      fixed-width INDEX_ENTRY records (key, offset, count, kind)
+               sorted by kind and key
+    header     UTF-8 JSON with the projection parameters
+
+Parallels and meridians are stored as x0, y0, x1, y1, ... and nodes as
+long0, x0, y0, long1, x1, y1, ... Line keys are integer arc-seconds, as in
+GridBuilder.
+
+The data is written one line at a time while the grid is built. Index
+records are spooled to a side file and appended when the writer is closed.
+GridDataset maps the file with mmap and binary searches the index in place.
+Neither side keeps per-line state in memory: the writer holds one line and
+the list of node longitudes, the reader only the lines it is asked for.
+Parallels and meridians are sampled every DEFAULT_DEGREES_STEP whatever
+the grid step, so only node lines grow with a finer step_lam.
+"""
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+import projection as pr
+
+
+MAGIC = b'SPGRID\x00\x02'
+PREAMBLE = struct.Struct('<8sQQQQ')
+INDEX_ENTRY = struct.Struct('<qQQB7x')
+FORMAT_VERSION = 2
+DOUBLE_SIZE = 8
+
+PARALLELS = 'parallels'
+MERIDIANS = 'meridians'
+NODES = 'nodes'
+# Floats per point for each kind of line
+POINT_SIZES = {PARALLELS: 2, MERIDIANS: 2, NODES: 3}
+KIND_CODES = {PARALLELS: 0, MERIDIANS: 1, NODES: 2}
+MIN_KEY = -2**63
+
+
+def get_parameters(grid):
+    projector = grid.projector
+    sphere = projector.to_sphere
+    parameters = {
+        'phi0': grid.lat0,
+        'lam0': grid.long0,
+        'step_phi': grid.step_phi,
+        'step_lam': grid.step_lam,
+        'sphere_projection': type(sphere).__name__,
+        'r': sphere.r,
+    }
+    ellipsoid = getattr(sphere, 'ellipsoid', None)
+    if ellipsoid is not None:
+        parameters['a'] = ellipsoid.a
+        parameters['b'] = ellipsoid.b
+    return parameters
+
+
+class GridWriter:
+    # Writes to path + '.tmp' and replaces path only when closed successfully
+    def __init__(self, path, parameters):
+        self.path = path
+        self.parameters = parameters
+        self.tmp_path = path + '.tmp'
+        self.index_path = path + '.index.tmp'
+
+        self.__file = open(self.tmp_path, 'wb')
+        try:
+            self.__index = open(self.index_path, 'w+b')
+        except OSError:
+            self.__file.close()
+            os.remove(self.tmp_path)
+            raise
+        self.__file.write(PREAMBLE.pack(MAGIC, 0, 0, 0, 0))
+        self.__offset = PREAMBLE.size
+        self.__count = 0
+        self.__last = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_line(self, kind, key, points):
+        # points is an iterable of tuples of POINT_SIZES[kind] floats.
+        # Lines must come in increasing (kind, key) order, kinds ordered as in KIND_CODES
+        code = KIND_CODES[kind]
+        if self.__last is not None and (code, key) <= self.__last:
+            raise ValueError('Lines must be written in increasing order, got {} {} after {}'.format(
+                kind, key, self.__last))
+        self.__last = (code, key)
+
+        values = array('d')
+        for point in points:
+            values.extend(point)
+        if sys.byteorder != 'little':
+            values.byteswap()
+
+        count = len(values) // POINT_SIZES[kind]
+        self.__index.write(INDEX_ENTRY.pack(key, self.__offset, count, code))
+        values.tofile(self.__file)
+        self.__offset += len(values) * DOUBLE_SIZE
+        self.__count += 1
+
+    def close(self):
+        if self.__file.closed:
+            return
+        try:
+            index_offset = self.__offset
+            self.__index.seek(0)
+            shutil.copyfileobj(self.__index, self.__file)
+
+            header = json.dumps({'version': FORMAT_VERSION, 'parameters': self.parameters}).encode('utf-8')
+            header_offset = index_offset + self.__count * INDEX_ENTRY.size
+            self.__file.write(header)
+            self.__file.seek(0)
+            self.__file.write(PREAMBLE.pack(MAGIC, index_offset, self.__count, header_offset, len(header)))
+        except BaseException:
+            self.abort()
+            raise
+        self.__file.close()
+        self.__index.close()
+        os.remove(self.index_path)
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        # Drops the partial output; an existing file at path is left alone
+        self.__file.close()
+        self.__index.close()
+        for path in (self.tmp_path, self.index_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def write_grid(path, grid, nodes=True):
+    # Streams the grid line by line. The lines come from a non-caching copy of
+    # grid, so its projection cache does not fill up with the whole grid
+    grid = pr.GridBuilder(grid.projector, grid.step_phi, grid.step_lam, grid.lat0, grid.long0,
+                          cache_projections=False)
+    with GridWriter(path, get_parameters(grid)) as writer:
+        for lat in grid.iter_latitudes():
+            half = [(x, y) for long, x, y in grid.iter_parallel(lat)]
+            half.extend([(x, -y) for x, y in half[-1::-1]])
+            writer.write_line(PARALLELS, pr.deg2sec(lat), half)
+
+        for long in grid.iter_longitudes():
+            writer.write_line(MERIDIANS, pr.deg2sec(long), grid.iter_meridian(long))
+
+        if nodes:
+            for lat in grid.iter_latitudes():
+                writer.write_line(NODES, pr.deg2sec(lat), grid.iter_parallel_nodes(lat))
+    return path
+
+
+class GridDataset:
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, 'rb')
+        try:
+            self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.__file.close()
+            raise ValueError('Empty grid file: {}'.format(path))
+
+        try:
+            self.__read_header()
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+        self.lat_dict = LinesView(self, PARALLELS)
+        self.long_dict = LinesView(self, MERIDIANS)
+        self.lat_dict_to_show = LinesView(self, NODES)
+
+    def __read_header(self):
+        try:
+            magic, index_offset, index_count, header_offset, header_length = PREAMBLE.unpack_from(self.__mmap, 0)
+        except struct.error:
+            raise ValueError('Not a grid file: {}'.format(self.path))
+        if magic != MAGIC:
+            raise ValueError('Not a grid file: {}'.format(self.path))
+        if not header_length or header_offset + header_length > len(self.__mmap):
+            raise ValueError('Incomplete grid file: {}'.format(self.path))
+
+        header = json.loads(self.__mmap[header_offset:header_offset + header_length].decode('utf-8'))
+        self.__index_offset = index_offset
+        self.__index_count = index_count
+
+        self.parameters = header['parameters']
+        self.lat0 = self.parameters['phi0']
+        self.long0 = self.parameters['lam0']
+        self.step_phi = self.parameters['step_phi']
+        self.step_lam = self.parameters['step_lam']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        try:
+            if not self.__mmap.closed:
+                self.__mmap.close()
+        finally:
+            self.__file.close()
+
+    @property
+    def latitudes(self):
+        return [pr.sec2deg(key) for key in self.keys(PARALLELS)]
+
+    @property
+    def longitudes(self):
+        return [pr.sec2deg(key) for key in self.keys(MERIDIANS)]
+
+    def keys(self, kind):
+        start, stop = self.__get_kind_range(kind)
+        for i in range(start, stop):
+            yield self.__get_entry(i)[0]
+
+    def count(self, kind):
+        start, stop = self.__get_kind_range(kind)
+        return stop - start
+
+    def line_array(self, kind, key, start=0, stop=None):
+        # Flat float64 copy of points [start:stop) of a line; only that slice is read
+        offset, count = self.__find(kind, key)
+        size = POINT_SIZES[kind]
+        start, stop, _ = slice(start, stop).indices(count)
+        stop = max(start, stop)
+
+        values = array('d', self.__mmap[offset + start*size*DOUBLE_SIZE:offset + stop*size*DOUBLE_SIZE])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def line(self, kind, key, start=0, stop=None):
+        values = self.line_array(kind, key, start, stop)
+        size = POINT_SIZES[kind]
+        return list(zip(*(values[i::size] for i in range(size))))
+
+    def parallel(self, lat, start=0, stop=None):
+        return self.line(PARALLELS, pr.deg2sec(lat), start, stop)
+
+    def meridian(self, long, start=0, stop=None):
+        return self.line(MERIDIANS, pr.norm_long_sec(pr.deg2sec(long)), start, stop)
+
+    def parallel_nodes(self, lat, start=0, stop=None):
+        return self.line(NODES, pr.deg2sec(lat), start, stop)
+
+    def __get_entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.__mmap, self.__index_offset + i*INDEX_ENTRY.size)
+
+    def __bisect(self, code, key):
+        # First index entry not less than (code, key)
+        lo, hi = 0, self.__index_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_key, offset, count, entry_code = self.__get_entry(mid)
+            if (entry_code, entry_key) < (code, key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __get_kind_range(self, kind):
+        code = KIND_CODES[kind]
+        return self.__bisect(code, MIN_KEY), self.__bisect(code + 1, MIN_KEY)
+
+    def __find(self, kind, key):
+        code = KIND_CODES[kind]
+        i = self.__bisect(code, key)
+        if i < self.__index_count:
+            entry_key, offset, count, entry_code = self.__get_entry(i)
+            if (entry_code, entry_key) == (code, key):
+                return offset, count
+        raise KeyError(key)
+
+
+class LinesView(Mapping):
+    # Read-only lat_dict/long_dict lookalike; a line is read when it is accessed
+    def __init__(self, dataset, kind):
+        self.dataset = dataset
+        self.kind = kind
+
+    def __getitem__(self, key):
+        key = pr.deg2sec(key)
+        if self.kind == MERIDIANS:
+            key = pr.norm_long_sec(key)
+        return self.dataset.line(self.kind, key)
+
+    def __iter__(self):
+        return (pr.sec2deg(key) for key in self.dataset.keys(self.kind))
+
+    def __len__(self):
+        return self.dataset.count(self.kind)
+
+
+if __name__ == '__main__':
+    import resource
+    import time
+
+    import to_sphere as ts
+
+    # python griddata.py PATH STEP_DEG [PHI0 LAM0]
+    out_path = sys.argv[1]
+    step = float(sys.argv[2])
+    phi0 = float(sys.argv[3]) if len(sys.argv) > 3 else 45.0
+    lam0 = float(sys.argv[4]) if len(sys.argv) > 4 else 30.0
+
+    el = ts.EllipsoidHolder(ts.load_ellipsoids()['GSK_2011'])
+    plane_projector = pr.StereographicProjector(ts.EquidistantProjector(el, phi0), phi0, lam0)
+    grid_builder = pr.GridBuilder(plane_projector, step, step, phi0, lam0)
+
+    t = time.perf_counter()
+    write_grid(out_path, grid_builder, nodes=False)
+    print('written in {:.2f} s'.format(time.perf_counter() - t))
+
+    with GridDataset(out_path) as dataset:
+        print('{} parallels, {} meridians'.format(len(dataset.lat_dict), len(dataset.long_dict)))
+    print('peak RSS {} KiB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
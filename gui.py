@@ -1,10 +1,9 @@
-import configparser
 import sys
 import os
 
 from PyQt4 import QtCore
 from PyQt4.QtGui import QApplication, QDoubleValidator, QPainter, QTableWidgetItem, QFont
-from forms import MainForm, GridForm
+import forms
 
 import to_sphere as ts
 import projection as pr
@@ -23,8 +22,8 @@ PPcM = 96 / 2.54
 
 class Main:
     def __init__(self):
-        self.main_form = MainForm()
-        self.grid_form = GridForm()
+        self.main_form = forms.MainForm()
+        self.grid_form = forms.GridForm()
         self.ellipsoids_ini = self.__parse_ellipsoids()
         self.ellipsoid = None
         self.sphere_projection_type = None
@@ -35,9 +34,7 @@ class Main:
     @staticmethod
     def __parse_ellipsoids():
         path = os.path.join(PLUGIN_PATH, r'data', r'Ellipsoids.ini')
-        config = configparser.ConfigParser()
-        config.read(path)
-        return config
+        return ts.load_ellipsoids(path)
 
     def __init_ui(self):
         self.__fill_ellipsoids()
@@ -105,20 +102,14 @@ class Main:
 
     def __fill_table(self):
         table = self.main_form.table
+        table_data = self.grid_painter.grid.node_table()
 
-        lat_dict_to_show = self.grid_painter.grid.lat_dict_to_show
-
-        table_data = []
-        for phi, points in sorted(lat_dict_to_show.items(), key=lambda p: p[0]):
-            for lam, x, y in points:
-                table_data.append([ts.dms_str(phi), ts.dms_str(lam), '{: .3f}'.format(x), '{: .3f}'.format(y)])
-
+        table.setUpdatesEnabled(False)
         table.setRowCount(len(table_data))
         for i, row in enumerate(table_data):
             for j, value in enumerate(row):
-                item = QTableWidgetItem()
-                item.setText(value)
-                table.setItem(i, j, item)
+                table.setItem(i, j, QTableWidgetItem(value))
+        table.setUpdatesEnabled(True)
 
     def __scale_changed(self):
         scale = self.grid_form.scale.value()
@@ -134,7 +125,7 @@ class Main:
     def __fill_ellipsoids(self):
         cbox = self.main_form.ellipsoid
         cbox.clear()
-        lst = self.ellipsoids_ini.sections()
+        lst = list(self.ellipsoids_ini)
         lst.append('Пользовательский')
         cbox.addItems(lst)
         cbox.setCurrentIndex(cbox.findText('GSK_2011'))
@@ -1,10 +1,17 @@
-from math import sin, cos, tan, acos, atan, pi, radians, degrees, hypot
+from itertools import repeat
+from math import sin, cos, tan, asin, acos, atan, atan2, pi, radians, degrees, hypot
+
+import to_sphere as ts
 
 
 pi2 = pi*2
 
 # TODO: Use decimal instead of float
 DEFAULT_DEGREES_STEP = 0.5
+ARCSEC = 3600
+QUARTER_TURN = 90*ARCSEC
+HALF_TURN = 180*ARCSEC
+NODE_COORD_FORMAT = '{: .3f}'
 
 
 class StereographicProjector:
@@ -35,39 +42,20 @@ class StereographicProjector:
         part1 = cos(rad_phi) * sin(dlam)
         part2 = sin(rad_phi) * cos(rad_phi0)
         part3 = cos(rad_phi) * sin(rad_phi0) * cos(dlam)
-        tan_a = part1 / (part2 - part3)
-        rad_a = atan(tan_a)
+        rad_a = atan2(part1, part2 - part3)
 
-        rad_a = self.__get_direction(rad_a, tan_a, phi, lam)
+        if abs(part1) < 1e-10*abs(part2 - part3):
+            # On the lam0 meridian, its antimeridian or a pole the direction is
+            # due north or due south; snap it so rounding cannot flip the side
+            rad_a = 0.0 if part2 - part3 > 0 else pi
 
         return z, degrees(rad_a)
 
-    def __get_direction(self, rad_a, tan_a, phi, lam):
-        close = abs(rad_a) < 1e-10
-        if not close and tan_a < 0.0:
-            rad_a = pi - rad_a
-        elif close:
-            if self.phi0 >= 0:
-                if self.phi0 > phi:
-                    if phi < -self.phi0:
-                        rad_a = pi
-                    elif phi >= -self.phi0:
-                        if abs(lam - self.lam0) < 1e-10:
-                            rad_a = pi
-            else:
-                if self.phi0 >= phi:
-                    rad_a = pi
-                else:
-                    if phi < -self.phi0:
-                        if not abs(lam - self.lam0) < 1e-10:
-                            rad_a = pi
-        return rad_a
-
     def project2plane(self, phi, lam, m=1):
         phi, lam = self.to_sphere.project(phi, lam)
 
-        lam_is_0 = abs(lam - self.lam0) < 1e-10
-        lam_is_180 = abs(norm_long(lam - 180.0) - self.lam0) < 1e-10
+        lam_is_0 = abs(norm_long(lam - self.lam0)) < 1e-10
+        lam_is_180 = abs(norm_long(lam - 180.0 - self.lam0)) < 1e-10
         pole = abs(phi - self.phi0) < 1e-10 and lam_is_0
         pole2 = abs(-phi - self.phi0) < 1e-10 and lam_is_180
         if pole2:
@@ -84,93 +72,220 @@ class StereographicProjector:
         y = ro*sin(sig)
         return x/m, y/m
 
+    def project2geographic(self, x, y, m=1):
+        # Inverse of project2plane for the grid plane: y > 0 is east of lam0
+        x, y = x*m, y*m
+        rad_phi0 = self.rad_phi0
+
+        z = 2*atan(hypot(x, y) / (2*self.to_sphere.r))
+        rad_a = atan2(y, x)
+
+        sin_phi = sin(rad_phi0)*cos(z) + cos(rad_phi0)*sin(z)*cos(rad_a)
+        rad_phi = asin(max(-1.0, min(1.0, sin_phi)))
+        dlam = atan2(sin(rad_a)*sin(z)*cos(rad_phi0), cos(z) - sin(rad_phi0)*sin_phi)
+
+        phi, lam = ts.inverse_project(self.to_sphere, degrees(rad_phi), self.lam0 + degrees(dlam))
+        return phi, norm_long(lam)
+
 
 class GridBuilder:
-    def __init__(self, to_plane_projector, step_phi, step_lam, lat0, long0):
+    # Grid lines and samples live on an integer lattice of arc-seconds, so
+    # steps like 0.1 or 1/3 of a degree hit every line exactly and lines are
+    # looked up by int keys
+    def __init__(self, to_plane_projector, step_phi, step_lam, lat0, long0, cache_projections=True):
         self.projector = to_plane_projector
         self.step_phi = step_phi
         self.step_lam = step_lam
         self.lat0 = lat0
         self.long0 = long0
 
+        self.__step_phi = step2sec(step_phi)
+        self.__step_lam = step2sec(step_lam)
+        self.__long0 = long2sec(long0)
+        self.__sample_step = deg2sec(DEFAULT_DEGREES_STEP)
+
+        self.cache_projections = cache_projections
         self.__projection_cache = dict()
-        self.lat_dict, self.long_dict, self.lat_dict_to_show = self.build()
+        self.__node_longitudes = None
+
+        self.__parallels = dict()
+        self.__parallel_nodes = dict()
+        self.__meridians = dict()
+
+        self.__lat_dict = None
+        self.__long_dict = None
+        self.__lat_dict_to_show = None
+
+    @property
+    def lat_dict(self):
+        if self.__lat_dict is None:
+            self.__lat_dict = {lat: self.parallel(lat) for lat in self.latitudes}
+        return self.__lat_dict
+
+    @property
+    def long_dict(self):
+        if self.__long_dict is None:
+            self.__long_dict = {long: self.meridian(long) for long in self.longitudes}
+        return self.__long_dict
+
+    @property
+    def lat_dict_to_show(self):
+        if self.__lat_dict_to_show is None:
+            self.__lat_dict_to_show = {lat: self.parallel_nodes(lat) for lat in self.latitudes}
+        return self.__lat_dict_to_show
+
+    @property
+    def latitudes(self):
+        return list(self.iter_latitudes())
+
+    @property
+    def longitudes(self):
+        return list(self.iter_longitudes())
+
+    def iter_latitudes(self):
+        return map(sec2deg, self.__get_latitudes())
+
+    def iter_longitudes(self):
+        return map(sec2deg, self.__get_meridian_longitudes())
 
     def project(self, lat, long):
-        p = self.__projection_cache.get((lat, long), self.projector.project2plane(lat, long))
-        return p
+        key = (lat, long)
+        try:
+            return self.__projection_cache[key]
+        except KeyError:
+            p = self.projector.project2plane(lat, long)
+            if self.cache_projections:
+                self.__projection_cache[key] = p
+            return p
+
+    def iter_parallel(self, lat):
+        # Yields (long, x, |y|) for the eastern half of the parallel
+        lat = sec2deg(deg2sec(lat))
+        for offset in range(HALF_TURN, -1, -self.__sample_step):
+            long = sec2deg(norm_long_sec(self.__long0 + offset))
+            try:
+                x, y = self.project(lat, long)
+            except ValueError:
+                pass
+            else:
+                yield long, x, abs(y)
+
+    def iter_meridian(self, long):
+        long, sign = self.__get_meridian_source(norm_long_sec(deg2sec(long)))
+        long = sec2deg(long)
+        for lat in range(89*ARCSEC, -89*ARCSEC - 1, -self.__sample_step):
+            try:
+                x, y = self.project(sec2deg(lat), long)
+            except ValueError:
+                pass
+            else:
+                yield x, sign*abs(y)
+
+    def parallel(self, lat):
+        key = deg2sec(lat)
+        try:
+            return self.__parallels[key]
+        except KeyError:
+            pass
+
+        points = [(x, y) for long, x, y in self.iter_parallel(lat)]
+        points.extend([(x, -y) for x, y in points[-1::-1]])
+        self.__parallels[key] = points
+        return points
+
+    def iter_parallel_nodes(self, lat):
+        # Yields (long, x, |y|) where the parallel crosses the eastern meridians
+        lat = sec2deg(deg2sec(lat))
+        for long in self.__get_node_longitudes():
+            long = sec2deg(long)
+            try:
+                x, y = self.project(lat, long)
+            except ValueError:
+                pass
+            else:
+                yield long, x, abs(y)
+
+    def parallel_nodes(self, lat):
+        key = deg2sec(lat)
+        try:
+            return self.__parallel_nodes[key]
+        except KeyError:
+            pass
+
+        nodes = list(self.iter_parallel_nodes(lat))
+        self.__parallel_nodes[key] = nodes
+        return nodes
+
+    def node_table(self):
+        # Rows of formatted (lat, long, x, y) for every node, sorted by latitude.
+        # Every parallel crosses the same meridians, so each longitude is
+        # formatted once
+        long_strs = {long: ts.dms_str(long) for long in map(sec2deg, self.__get_node_longitudes())}
+        lat_column = []
+        longs = []
+        xs = []
+        ys = []
+        for lat in self.latitudes:
+            nodes = self.parallel_nodes(lat)
+            lat_column.extend(repeat(ts.dms_str(lat), len(nodes)))
+            for long, x, y in nodes:
+                longs.append(long)
+                xs.append(x)
+                ys.append(y)
+
+        long_column = map(long_strs.__getitem__, longs)
+        x_column = map(NODE_COORD_FORMAT.format, xs)
+        y_column = map(NODE_COORD_FORMAT.format, ys)
+        return list(zip(lat_column, long_column, x_column, y_column))
+
+    def meridian(self, long):
+        key = norm_long_sec(deg2sec(long))
+        try:
+            return self.__meridians[key]
+        except KeyError:
+            pass
+
+        points = list(self.iter_meridian(long))
+        self.__meridians[key] = points
+        return points
 
     def build(self):
         self.__projection_cache = dict()
-        dlat = self.step_phi
-        dlong = self.step_lam
-        step_def = DEFAULT_DEGREES_STEP
-
-        lat_range = xfrange(-89, 89 + step_def, step_def)
-        lat_range = [norm_lat(lat) for lat in lat_range]
-
-        lon_range = xfrange(self.long0, self.long0 + 180 + step_def, step_def)
-        lon_range = [norm_long(lon) for lon in lon_range]
-
-        main_lat_range = list(xfrange(0, 90, dlat))
-        opposite_lat_range = [-lat for lat in main_lat_range[-1:0:-1]]
-        opposite_lat_range.extend(main_lat_range)
-        main_lat_range = [norm_lat(lat) for lat in opposite_lat_range]
-
-        main_lon_range = list(xfrange(0, 180+dlong, dlong))
-        opposit_lon_range = [-lon for lon in main_lon_range[-2:0:-1]]
-        opposit_lon_range.extend(main_lon_range)
-        main_lon_range = [norm_long(lon) for lon in opposit_lon_range]
-
-        lat_dict = dict()
-        lat_dict_to_show = dict()
-
-        for lat in main_lat_range:
-            points = []
-            points_to_show = []
-            if lat == 0:
-                print()
-            for long in lon_range[::-1]:
-                try:
-                    x, y = self.project(lat, long)
-                except ValueError:
-                    pass
-                else:
-                    abs_y = abs(y)
-                    points.append((x, abs_y))
-                    if long % dlong == 0:
-                        points_to_show.append((long, x, abs_y))
-            points.extend([(x, -y) for x, y in points[-1::-1]])
-            if abs(lat) < 1e-9:
-                lat = 0
-            lat_dict[lat] = points
-            lat_dict_to_show[lat] = points_to_show
-
-        long_dict = dict()
-        for long in lon_range:
-            opposit_long = norm_lat(-2*self.long0 + long)
-            if long in main_lon_range or opposit_long in main_lon_range:
-                points = []
-                points_left = []
-                for lat in lat_range[::-1]:
-                    try:
-                        x, y = self.project(lat, long)
-                    except ValueError:
-                        pass
-                    else:
-                        points.append((x, abs(y)))
-                        points_left.append((x, -abs(y)))
-                if abs(long) < 1e-9:
-                    long = 0
-
-                if long in main_lon_range:
-                    long_dict[long] = points
-                if opposit_long in main_lon_range:
-                    if not abs(self.long0) < 1e-9:
-                        long2 = norm_long(2*self.long0-long)
-                        long_dict[long2] = points_left
-
-        return lat_dict, long_dict, lat_dict_to_show
+        self.__parallels = dict()
+        self.__parallel_nodes = dict()
+        self.__meridians = dict()
+        self.__lat_dict = None
+        self.__long_dict = None
+        self.__lat_dict_to_show = None
+        return self.lat_dict, self.long_dict, self.lat_dict_to_show
+
+    def __get_latitudes(self):
+        # Multiples of step_phi strictly between the poles, south to north
+        k = (QUARTER_TURN - 1) // self.__step_phi
+        return range(-k*self.__step_phi, k*self.__step_phi + 1, self.__step_phi)
+
+    def __get_meridian_source(self, long):
+        # Longitude actually projected and sign of y for a meridian.
+        # Western meridians are mirrors of the eastern ones about long0
+        offset = norm_long_sec(long - self.__long0)
+        if offset >= 0:
+            return long, 1
+        return norm_long_sec(self.__long0 - offset), -1
+
+    def __get_meridian_longitudes(self):
+        # Multiples of step_lam in (-180, 180], west to east
+        step = self.__step_lam
+        west = -((HALF_TURN - 1) // step)
+        east = HALF_TURN // step
+        return range(west*step, east*step + 1, step)
+
+    def __get_node_longitudes(self):
+        # Meridians between long0 and long0 + 180, eastmost first
+        if self.__node_longitudes is None:
+            east_half = [long for long in self.__get_meridian_longitudes() if norm_long_sec(long - self.__long0) >= 0]
+            east_half.sort(key=lambda long: norm_long_sec(long - self.__long0), reverse=True)
+            self.__node_longitudes = east_half
+        return self.__node_longitudes
 
 
 def distance2line(x1, y1, x2, y2, x0, y0):
@@ -200,14 +315,36 @@ def norm_lat(deg_angle):
         return deg_angle
 
 
-# Weak
-def xfrange(start, stop, step):
-    i = 0
-    if start <= stop:
-        while start + i * step < stop:
-            yield start + i * step
-            i += 1
-    else:
-        while start + i * step > stop:
-            yield start + i * step
-            i += 1
+def deg2sec(deg_angle):
+    return int(round(deg_angle*ARCSEC))
+
+
+def step2sec(deg_step):
+    # Rounding a step like 1/7 of a degree would drift the lines off its multiples
+    sec_step = deg_step*ARCSEC
+    if round(sec_step) <= 0 or abs(sec_step - round(sec_step)) > 1e-6:
+        raise ValueError('Grid step must be a positive whole number of arc-seconds, got {}°'.format(deg_step))
+    return int(round(sec_step))
+
+
+def long2sec(deg_long):
+    # Western meridians are mirrored about long0, so it must be on the lattice too
+    sec_long = deg_long*ARCSEC
+    if abs(sec_long - round(sec_long)) > 1e-6:
+        raise ValueError('Central meridian must be a whole number of arc-seconds, got {}°'.format(deg_long))
+    return norm_long_sec(int(round(sec_long)))
+
+
+def sec2deg(sec_angle):
+    # Whole degrees stay int so they are exact keys and labels
+    degs, rest = divmod(sec_angle, ARCSEC)
+    if rest:
+        return sec_angle / ARCSEC
+    return degs
+
+
+def norm_long_sec(sec_angle):
+    sec_angle = (sec_angle + HALF_TURN) % (2*HALF_TURN) - HALF_TURN
+    if sec_angle == -HALF_TURN:
+        return HALF_TURN
+    return sec_angle
@@ -0,0 +1,420 @@
+"""Local HTTP projection service.
+
+    python service.py [--host 127.0.0.1] [--port 8765] [--workers N]
+
+Endpoints (JSON in, JSON out):
+
+    POST /forward   {"points": [[phi, lam], ...], ...projection parameters}
+    POST /inverse   {"points": [[x, y], ...], ...projection parameters}
+    POST /grid      {"step_phi": 10, "step_lam": 10, ...projection parameters}
+    GET  /metrics
+
+Projection parameters are "ellipsoid" (a name from data/Ellipsoids.ini or an
+object with "A", "B" and optionally "F1"), "projection" (a key of
+SPHERE_PROJECTIONS), "phi0", "lam0" and optionally "m". Grid steps are
+limited to MIN_GRID_STEP and coarser; griddata.py handles finer grids.
+
+Point requests for the same parameters that arrive within BATCH_WINDOW are
+merged into one batch and projected in a single call to a worker process.
+Every worker keeps its own pool of warm projectors.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import time
+
+import to_sphere as ts
+import projection as pr
+
+
+SPHERE_PROJECTIONS = {
+    'mollweide': ts.MollweideProjector,
+    'gauss1': ts.GaussFirstProjector,
+    'gauss2': ts.GaussSecondProjector,
+    'equal_area': ts.EqualAreaProjector,
+    'equidistant': ts.EquidistantProjector,
+}
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Seconds a point request waits for others to join its batch
+BATCH_WINDOW = 0.002
+MAX_BATCH_POINTS = 50000
+# Finer grids than the sampling step of the lines are too large for one
+# response; write them with griddata instead
+MIN_GRID_STEP = pr.DEFAULT_DEGREES_STEP
+PROJECTOR_POOL_SIZE = 32
+LATENCY_SAMPLES = 10000
+THROUGHPUT_WINDOW = 60.0
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+# Worker side
+
+_projectors = collections.OrderedDict()
+
+
+def get_projector(key):
+    # LRU pool of StereographicProjector keyed by projection parameters
+    try:
+        _projectors.move_to_end(key)
+        return _projectors[key]
+    except KeyError:
+        pass
+
+    ellipsoid, projection, phi0, lam0 = key
+    a, b, f1, el_id = ellipsoid
+    holder = ts.EllipsoidHolder({'A': a, 'B': b, 'F1': f1, 'Id': el_id})
+    sphere_projector = SPHERE_PROJECTIONS[projection](holder, phi0)
+    projector = pr.StereographicProjector(sphere_projector, phi0, lam0)
+
+    _projectors[key] = projector
+    if len(_projectors) > PROJECTOR_POOL_SIZE:
+        _projectors.popitem(last=False)
+    return projector
+
+
+# A point that cannot be projected gets null; errors must not escape a batch,
+# which holds points of unrelated requests
+POINT_ERRORS = (ValueError, ArithmeticError)
+
+
+def forward_batch(key, m, points):
+    # project2plane is only valid east of lam0; the grid mirrors the other
+    # half and so does this. The eastern longitude is left unwrapped so that
+    # sphere projections scaling longitude see the true offset from lam0
+    projector = get_projector(key)
+    lam0 = key[3]
+    result = []
+    for phi, lam in points:
+        dlam = pr.norm_long(lam - lam0)
+        try:
+            x, y = projector.project2plane(phi, lam0 + abs(dlam), m)
+        except POINT_ERRORS:
+            result.append(None)
+        else:
+            result.append((x, math.copysign(abs(y), dlam)))
+    return result
+
+
+def inverse_batch(key, m, points):
+    projector = get_projector(key)
+    result = []
+    for x, y in points:
+        try:
+            result.append(projector.project2geographic(x, y, m))
+        except POINT_ERRORS:
+            result.append(None)
+    return result
+
+
+def build_grid(key, step_phi, step_lam):
+    projector = get_projector(key)
+    phi0, lam0 = key[2], key[3]
+    grid = pr.GridBuilder(projector, step_phi, step_lam, phi0, lam0)
+    return {
+        'parallels': [[lat, points] for lat, points in grid.lat_dict.items()],
+        'meridians': [[long, points] for long, points in grid.long_dict.items()],
+        'nodes': [[lat, nodes] for lat, nodes in grid.lat_dict_to_show.items()],
+    }
+
+
+BATCH_FUNCTIONS = {
+    'forward': forward_batch,
+    'inverse': inverse_batch,
+}
+
+
+# Server side
+
+class Batcher:
+    def __init__(self, executor):
+        self.executor = executor
+        self.pending = dict()
+        self.batches = 0
+        self.batched_points = 0
+
+    async def submit(self, kind, key, m, points):
+        loop = asyncio.get_running_loop()
+        batch_key = (kind, key, m)
+        future = loop.create_future()
+
+        batch = self.pending.get(batch_key)
+        if batch is None:
+            batch = self.pending[batch_key] = []
+            loop.call_later(BATCH_WINDOW, self.__flush, batch_key, batch)
+        batch.append((points, future))
+
+        if sum(len(p) for p, f in batch) >= MAX_BATCH_POINTS:
+            self.__flush(batch_key, batch)
+        return await future
+
+    def __flush(self, batch_key, batch):
+        if self.pending.get(batch_key) is not batch:
+            return
+        del self.pending[batch_key]
+
+        kind, key, m = batch_key
+        points = [point for p, f in batch for point in p]
+        self.batches += 1
+        self.batched_points += len(points)
+
+        loop = asyncio.get_running_loop()
+        try:
+            task = loop.run_in_executor(self.executor, BATCH_FUNCTIONS[kind], key, m, points)
+        except Exception as e:
+            # A broken or shut down executor; nothing would resolve the futures
+            for p, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        task.add_done_callback(lambda t: self.__distribute(t, batch))
+
+    @staticmethod
+    def __distribute(task, batch):
+        if task.exception() is not None:
+            for p, future in batch:
+                if not future.done():
+                    future.set_exception(task.exception())
+            return
+
+        result = task.result()
+        start = 0
+        for p, future in batch:
+            if not future.done():
+                future.set_result(result[start:start+len(p)])
+            start += len(p)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+        self.counts = collections.Counter()
+        self.errors = collections.Counter()
+        self.points = collections.Counter()
+        self.recent = collections.deque()
+
+    def record(self, endpoint, seconds, points=0, error=False):
+        now = time.monotonic()
+        self.latencies[endpoint].append(seconds)
+        self.counts[endpoint] += 1
+        self.points[endpoint] += points
+        if error:
+            self.errors[endpoint] += 1
+
+        self.recent.append((now, points))
+        while self.recent and self.recent[0][0] < now - THROUGHPUT_WINDOW:
+            self.recent.popleft()
+
+    def report(self, batcher):
+        now = time.monotonic()
+        uptime = now - self.started
+        window = min(uptime, THROUGHPUT_WINDOW) or 1.0
+        endpoints = dict()
+        for endpoint, samples in self.latencies.items():
+            ordered = sorted(samples)
+            endpoints[endpoint] = {
+                'requests': self.counts[endpoint],
+                'errors': self.errors[endpoint],
+                'points': self.points[endpoint],
+                'latency_ms': {
+                    'p50': percentile(ordered, 50) * 1000,
+                    'p90': percentile(ordered, 90) * 1000,
+                    'p99': percentile(ordered, 99) * 1000,
+                    'max': ordered[-1] * 1000,
+                },
+            }
+        return {
+            'uptime_s': uptime,
+            'throughput': {
+                'requests_per_s': len(self.recent) / window,
+                'points_per_s': sum(p for t, p in self.recent) / window,
+            },
+            'batches': batcher.batches,
+            'mean_batch_points': batcher.batched_points / batcher.batches if batcher.batches else 0.0,
+            'endpoints': endpoints,
+        }
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    i = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[i]
+
+
+class ProjectionService:
+    def __init__(self, executor):
+        self.executor = executor
+        self.batcher = Batcher(executor)
+        self.metrics = Metrics()
+        self.ellipsoids = ts.load_ellipsoids()
+        self.routes = {
+            ('POST', '/forward'): self.forward,
+            ('POST', '/inverse'): self.inverse,
+            ('POST', '/grid'): self.grid,
+            ('GET', '/metrics'): self.report_metrics,
+        }
+
+    async def forward(self, params):
+        return await self.__project('forward', params)
+
+    async def inverse(self, params):
+        return await self.__project('inverse', params)
+
+    async def grid(self, params):
+        key = self.__get_key(params)
+        try:
+            step_phi = float(params['step_phi'])
+            step_lam = float(params['step_lam'])
+        except (KeyError, TypeError, ValueError):
+            raise RequestError('"step_phi" and "step_lam" are required numbers')
+        if not (MIN_GRID_STEP <= step_phi <= 180 and MIN_GRID_STEP <= step_lam <= 180):
+            raise RequestError('Steps must be between {} and 180 degrees'.format(MIN_GRID_STEP))
+
+        loop = asyncio.get_running_loop()
+        grid = await loop.run_in_executor(self.executor, build_grid, key, step_phi, step_lam)
+        return grid, 0
+
+    async def report_metrics(self, params):
+        return self.metrics.report(self.batcher), 0
+
+    async def __project(self, kind, params):
+        key = self.__get_key(params)
+        try:
+            points = [(float(a), float(b)) for a, b in params['points']]
+        except (KeyError, TypeError, ValueError):
+            raise RequestError('"points" must be a list of [a, b] pairs')
+        try:
+            m = float(params.get('m', 1))
+        except (TypeError, ValueError):
+            raise RequestError('"m" must be a number')
+        if m == 0 or not math.isfinite(m):
+            raise RequestError('"m" must be a finite non-zero number')
+        result = await self.batcher.submit(kind, key, m, points)
+        return {'points': result}, len(points)
+
+    def __get_key(self, params):
+        ellipsoid = params.get('ellipsoid', 'GSK_2011')
+        if isinstance(ellipsoid, str):
+            try:
+                ellipsoid = self.ellipsoids[ellipsoid]
+            except KeyError:
+                raise RequestError('Unknown ellipsoid: {}'.format(ellipsoid))
+        try:
+            a, b = float(ellipsoid['A']), float(ellipsoid['B'])
+            f1 = float(ellipsoid.get('F1', a / (a - b)))
+            el_id = int(ellipsoid.get('Id', -1))
+        except (KeyError, TypeError, ValueError, ZeroDivisionError, AttributeError):
+            raise RequestError('Ellipsoid must have numeric "A" and "B"')
+
+        projection = params.get('projection', 'equidistant')
+        if projection not in SPHERE_PROJECTIONS:
+            raise RequestError('Unknown projection: {}'.format(projection))
+        try:
+            phi0 = float(params['phi0'])
+            lam0 = float(params['lam0'])
+        except (KeyError, TypeError, ValueError):
+            raise RequestError('"phi0" and "lam0" are required numbers')
+        return (a, b, f1, el_id), projection, phi0, lam0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = b''
+                length = int(headers.get('content-length', 0))
+                if length:
+                    body = await reader.readexactly(length)
+
+                status, payload = await self.dispatch(method, path.split('?')[0], body)
+                data = json.dumps(payload).encode('utf-8')
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                writer.write((
+                    'HTTP/1.1 {} {}\r\n'
+                    'Content-Type: application/json\r\n'
+                    'Content-Length: {}\r\n'
+                    'Connection: {}\r\n\r\n'
+                ).format(status, HTTP_REASONS[status], len(data), 'keep-alive' if keep_alive else 'close').encode('latin-1'))
+                writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        start = time.perf_counter()
+        route = self.routes.get((method, path))
+        if route is None:
+            if any(p == path for m, p in self.routes):
+                return 405, {'error': 'Method not allowed'}
+            return 404, {'error': 'Not found'}
+
+        points = 0
+        try:
+            params = json.loads(body.decode('utf-8')) if body else dict()
+            if not isinstance(params, dict):
+                raise RequestError('Request body must be a JSON object')
+            payload, points = await route(params)
+            status = 200
+        except RequestError as e:
+            status, payload = e.status, {'error': str(e)}
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+
+        if path != '/metrics':
+            self.metrics.record(path, time.perf_counter() - start, points, status != 200)
+        return status, payload
+
+
+async def serve(host, port, workers):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        service = ProjectionService(executor)
+        server = await asyncio.start_server(service.handle, host, port)
+        print('Serving on http://{}:{}'.format(host, port))
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stereographic projection service')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import os
+import tracemalloc
+
+import pytest
+
+import griddata as gd
+import projection as pr
+import to_sphere as ts
+
+
+@pytest.fixture(scope='module')
+def ellipsoid():
+    return ts.EllipsoidHolder(ts.load_ellipsoids()['Krassovsky_1940'])
+
+
+def make_grid(ellipsoid, phi0, lam0, step, **kwargs):
+    projector = pr.StereographicProjector(ts.MollweideProjector(ellipsoid, phi0), phi0, lam0)
+    return pr.GridBuilder(projector, step, step, phi0, lam0, **kwargs)
+
+
+@pytest.mark.parametrize('phi0, lam0, step', [(45, 30, 5), (0, 0, 2.5), (-30, 37.25, 7.5)])
+def test_round_trip(tmp_path, ellipsoid, phi0, lam0, step):
+    path = str(tmp_path / 'grid.spg')
+    gd.write_grid(path, make_grid(ellipsoid, phi0, lam0, step))
+    grid = make_grid(ellipsoid, phi0, lam0, step)
+
+    with gd.GridDataset(path) as dataset:
+        assert dataset.parameters['step_phi'] == step
+        assert dataset.long0 == lam0
+        assert list(dataset.lat_dict) == list(grid.lat_dict)
+        assert list(dataset.long_dict) == list(grid.long_dict)
+        assert dict(dataset.lat_dict) == grid.lat_dict
+        assert dict(dataset.long_dict) == grid.long_dict
+        assert dict(dataset.lat_dict_to_show) == grid.lat_dict_to_show
+
+        lat = grid.latitudes[3]
+        assert dataset.parallel(lat, 10, 20) == grid.parallel(lat)[10:20]
+        assert dataset.parallel(lat, -5) == grid.parallel(lat)[-5:]
+        assert dataset.meridian(grid.longitudes[1]) == grid.meridian(grid.longitudes[1])
+        assert list(dataset.line_array(gd.PARALLELS, pr.deg2sec(lat), 0, 2)) == list(sum(grid.parallel(lat)[:2], ()))
+
+        with pytest.raises(KeyError):
+            dataset.parallel(90)
+
+
+def test_close_with_slices_alive(tmp_path, ellipsoid):
+    path = str(tmp_path / 'grid.spg')
+    gd.write_grid(path, make_grid(ellipsoid, 45, 30, 10))
+
+    with gd.GridDataset(path) as dataset:
+        values = dataset.line_array(gd.PARALLELS, 0)
+        points = dataset.parallel(0)
+    assert len(values) == 2*len(points)
+
+
+def test_failed_write_keeps_existing_file(tmp_path, ellipsoid):
+    path = str(tmp_path / 'grid.spg')
+    gd.write_grid(path, make_grid(ellipsoid, 45, 30, 10))
+    with open(path, 'rb') as f:
+        original = f.read()
+
+    with pytest.raises(RuntimeError):
+        with gd.GridWriter(path, {}) as writer:
+            writer.write_line(gd.PARALLELS, 0, [(1.0, 2.0)])
+            raise RuntimeError('build failed')
+
+    with open(path, 'rb') as f:
+        assert f.read() == original
+    assert sorted(os.listdir(str(tmp_path))) == ['grid.spg']
+
+
+def test_lines_out_of_order_are_rejected(tmp_path):
+    path = str(tmp_path / 'grid.spg')
+    with pytest.raises(ValueError):
+        with gd.GridWriter(path, {}) as writer:
+            writer.write_line(gd.MERIDIANS, 0, [])
+            writer.write_line(gd.PARALLELS, 3600, [])
+    assert not os.path.exists(path)
+
+
+def test_bad_files_are_rejected(tmp_path):
+    not_grid = tmp_path / 'not_grid.spg'
+    not_grid.write_bytes(b'x' * 100)
+    incomplete = tmp_path / 'incomplete.spg'
+    incomplete.write_bytes(gd.PREAMBLE.pack(gd.MAGIC, 0, 0, 0, 0) + b'\0' * 64)
+    empty = tmp_path / 'empty.spg'
+    empty.write_bytes(b'')
+
+    for path in (not_grid, incomplete, empty):
+        with pytest.raises(ValueError):
+            gd.GridDataset(str(path))
+
+
+def write_lines(path, count):
+    parameters = {'phi0': 0, 'lam0': 0, 'step_phi': 1, 'step_lam': 1}
+    with gd.GridWriter(path, parameters) as writer:
+        for key in range(count):
+            writer.write_line(gd.PARALLELS, key, [(float(key), 0.0)] * 4)
+
+
+def read_lines(path):
+    with gd.GridDataset(path) as dataset:
+        assert dataset.parallel(pr.sec2deg(7)) == [(7.0, 0.0)] * 4
+        assert sum(1 for key in dataset.lat_dict) == dataset.count(gd.PARALLELS)
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_memory_does_not_grow_with_line_count(tmp_path):
+    small = str(tmp_path / 'small.spg')
+    large = str(tmp_path / 'large.spg')
+
+    small_write = peak_memory(write_lines, small, 1000)
+    large_write = peak_memory(write_lines, large, 50000)
+    assert large_write < small_write + 64*1024
+
+    small_read = peak_memory(read_lines, small)
+    large_read = peak_memory(read_lines, large)
+    assert large_read < small_read + 64*1024
+
+
+def test_write_grid_memory_does_not_grow_with_resolution(tmp_path, ellipsoid):
+    # write_grid must not fill the projection cache of a caching builder
+    coarse = make_grid(ellipsoid, 45, 30, 30)
+    fine = make_grid(ellipsoid, 45, 30, 10)
+    assert fine.cache_projections
+
+    coarse_write = peak_memory(gd.write_grid, str(tmp_path / 'coarse.spg'), coarse)
+    fine_write = peak_memory(gd.write_grid, str(tmp_path / 'fine.spg'), fine)
+    assert fine_write < coarse_write + 64*1024
@@ -0,0 +1,246 @@
+from collections import Counter
+from math import sin, cos, tan, acos, atan, atan2, pi, radians, degrees
+
+import pytest
+
+import projection as pr
+import to_sphere as ts
+
+
+class IdentitySphere:
+    r = 1.0
+
+    @staticmethod
+    def project(phi, lam):
+        return phi, lam
+
+
+PHI0_SWEEP = [-90, -60, -30.5, -1e-9, 0, 1e-10, 15, 45, 89.5, 90]
+LAM0_SWEEP = [-180, -97.25, 0, 37.5, 180]
+PHI_SWEEP = [p / 2 for p in range(-178, 179, 7)] + [-89.5, 0, 89.5]
+# Offsets east of lam0, including the lam0 meridian and its antimeridian
+# where the azimuth is resolved by the pole/meridian edge cases
+DLAM_SWEEP = [0, 0.5, 45, 90.25, 135, 179.5, 180]
+
+
+def expected_plane(projector, phi, lam):
+    # Azimuth from north towards east resolved with atan2; the plane has
+    # x along the central meridian and |y| growing eastwards
+    rad_phi0 = projector.rad_phi0
+    rad_phi = radians(phi)
+    dlam = radians(pr.norm_long(lam - projector.lam0))
+
+    z = acos(sin(rad_phi)*sin(rad_phi0) + cos(rad_phi)*cos(rad_phi0)*cos(dlam))
+    rad_a = atan2(cos(rad_phi)*sin(dlam), sin(rad_phi)*cos(rad_phi0) - cos(rad_phi)*sin(rad_phi0)*cos(dlam))
+    ro = 2*IdentitySphere.r*tan(z/2)
+    return z, ro*cos(rad_a), ro*sin(rad_a)
+
+
+@pytest.mark.parametrize('lam0', LAM0_SWEEP)
+@pytest.mark.parametrize('phi0', PHI0_SWEEP)
+def test_direction_quadrants(phi0, lam0):
+    projector = pr.StereographicProjector(IdentitySphere, phi0, lam0)
+    phis = PHI_SWEEP + [projector.phi0, -projector.phi0]
+
+    checked = 0
+    for phi in phis:
+        for dlam in DLAM_SWEEP:
+            lam = pr.norm_long(projector.lam0 + dlam)
+            try:
+                x, y = projector.project2plane(phi, lam)
+            except ValueError:
+                # The antipode of the pole
+                continue
+            z, expected_x, expected_y = expected_plane(projector, phi, lam)
+            if z > pi - 1e-6:
+                # Next to the antipode the plane distance blows up
+                continue
+            assert x == pytest.approx(expected_x, rel=1e-9, abs=1e-9), (phi, dlam)
+            assert y == pytest.approx(expected_y, rel=1e-9, abs=1e-9), (phi, dlam)
+            checked += 1
+    assert checked > len(phis)
+
+
+def branchy_project2spherical(projector, phi, lam):
+    # Reference copy of the atan based project2spherical with its quadrant
+    # branches, kept to check the atan2 version against
+    rad_phi0 = projector.rad_phi0
+    rad_phi = radians(phi)
+
+    deg_dist = pr.norm_long(lam - projector.lam0)
+    if deg_dist > 180:
+        deg_dist -= 180
+    dlam = radians(deg_dist)
+
+    z = acos(sin(rad_phi)*sin(rad_phi0) + cos(rad_phi)*cos(rad_phi0)*cos(dlam))
+
+    part1 = cos(rad_phi) * sin(dlam)
+    part2 = sin(rad_phi) * cos(rad_phi0)
+    part3 = cos(rad_phi) * sin(rad_phi0) * cos(dlam)
+    tan_a = part1 / (part2 - part3)
+    rad_a = atan(tan_a)
+
+    close = abs(rad_a) < 1e-10
+    if not close and tan_a < 0.0:
+        rad_a = pi - rad_a
+    elif close:
+        if projector.phi0 >= 0:
+            if projector.phi0 > phi:
+                if phi < -projector.phi0:
+                    rad_a = pi
+                elif phi >= -projector.phi0:
+                    if abs(lam - projector.lam0) < 1e-10:
+                        rad_a = pi
+        else:
+            if projector.phi0 >= phi:
+                rad_a = pi
+            else:
+                if phi < -projector.phi0:
+                    if not abs(lam - projector.lam0) < 1e-10:
+                        rad_a = pi
+    return z, degrees(rad_a)
+
+
+DENSE_PHI_SWEEP = [p / 4 for p in range(-360, 361, 9)] + [-89.99, -45.01, 0.01, 45.01, 89.99]
+DENSE_DLAM_SWEEP = [d / 4 for d in range(0, 721, 9)] + [1e-11, 1e-7, 90.01, 179.99, 180 - 1e-11]
+
+
+@pytest.mark.parametrize('lam0', LAM0_SWEEP)
+@pytest.mark.parametrize('phi0', PHI0_SWEEP)
+def test_atan2_direction_matches_branchy_reference(phi0, lam0):
+    # The branchy version returns 360 - a in the second quadrant, which only
+    # flips the sign of y; the grid and the service use |y| east of lam0
+    projector = pr.StereographicProjector(IdentitySphere, phi0, lam0)
+    phis = DENSE_PHI_SWEEP + [projector.phi0, -projector.phi0]
+
+    checked = 0
+    for phi in phis:
+        for dlam in DENSE_DLAM_SWEEP:
+            lam = projector.lam0 + dlam
+            try:
+                expected_z, expected_a = branchy_project2spherical(projector, phi, lam)
+            except (ValueError, ZeroDivisionError):
+                continue
+            z, a = projector.project2spherical(phi, lam)
+            assert z == expected_z, (phi, dlam)
+            assert cos(radians(a)) == pytest.approx(cos(radians(expected_a)), abs=1e-9), (phi, dlam)
+            assert abs(sin(radians(a))) == pytest.approx(abs(sin(radians(expected_a))), abs=1e-9), (phi, dlam)
+            assert 0 <= a <= 180, (phi, dlam)
+            checked += 1
+    assert checked > len(phis) * len(DENSE_DLAM_SWEEP) * 0.9
+
+
+AWKWARD_STEPS = [
+    # step, parallels, meridians
+    (0.1, 1799, 3600),
+    (7.5, 23, 48),
+    (1 / 3, 539, 1080),
+]
+
+
+def make_grid(step, phi0=45, lam0=30, **kwargs):
+    projector = pr.StereographicProjector(IdentitySphere, phi0, lam0)
+    return pr.GridBuilder(projector, step, step, phi0, lam0, **kwargs)
+
+
+@pytest.mark.parametrize('step, parallels, meridians', AWKWARD_STEPS)
+def test_lattice_line_counts(step, parallels, meridians):
+    grid = make_grid(step)
+    assert len(grid.latitudes) == parallels
+    assert len(grid.longitudes) == meridians
+    assert len(set(map(pr.deg2sec, grid.latitudes))) == parallels
+    assert len(grid.parallel_nodes(30)) == round(180 / step) + 1
+
+
+@pytest.mark.parametrize('step, parallels, meridians', AWKWARD_STEPS)
+def test_lattice_lookup_by_float_multiples(step, parallels, meridians):
+    grid = make_grid(step)
+    count = (parallels - 1) // 2
+    latitudes = set(grid.latitudes)
+    longitudes = set(grid.longitudes)
+    for i in range(-count, count + 1):
+        assert pr.sec2deg(pr.deg2sec(i*step)) in latitudes, i
+    for i in range(-(meridians // 2) + 1, meridians // 2 + 1):
+        assert pr.sec2deg(pr.deg2sec(i*step)) in longitudes, i
+
+    lat = grid.latitudes[count + 7]
+    assert grid.parallel(7*step) is grid.parallel(lat)
+    assert grid.meridian(-3*step) is grid.meridian(grid.longitudes[meridians // 2 - 4])
+
+
+@pytest.mark.parametrize('step, parallels, meridians', AWKWARD_STEPS)
+def test_western_meridians_mirror_eastern(step, parallels, meridians):
+    grid = make_grid(step)
+    for i in (1, 7, round(90 / step), round(180 / step) - 1):
+        east = 30 + i*step
+        west = 30 - i*step
+        assert grid.meridian(west) == [(x, -y) for x, y in grid.meridian(east)], i
+
+
+@pytest.mark.parametrize('lam0', [30, 37.25, -180])
+def test_node_table(lam0):
+    grid = make_grid(7.5, 45, lam0)
+    rows = grid.node_table()
+    expected = [
+        (ts.dms_str(lat), ts.dms_str(long), pr.NODE_COORD_FORMAT.format(x), pr.NODE_COORD_FORMAT.format(y))
+        for lat in grid.latitudes for long, x, y in grid.parallel_nodes(lat)
+    ]
+    assert rows == expected
+
+
+@pytest.mark.parametrize('step', [1 / 7, 0.0001, 0, -1])
+def test_non_integral_step_is_rejected(step):
+    with pytest.raises(ValueError):
+        make_grid(step)
+
+
+@pytest.mark.parametrize('lam0', [180, -180])
+def test_antipode_at_antimeridian(lam0):
+    projector = pr.StereographicProjector(IdentitySphere, 30, lam0)
+    with pytest.raises(ValueError):
+        projector.project2plane(-30, 0)
+    assert projector.project2plane(30, -lam0) == (0.0, 0.0)
+
+    grid = make_grid(10, 30, lam0)
+    assert len(grid.long_dict) == 36
+    assert all(grid.long_dict.values())
+
+
+@pytest.mark.parametrize('lam0', [30.5 + 1e-5, 1 / 7])
+def test_non_integral_long0_is_rejected(lam0):
+    with pytest.raises(ValueError):
+        make_grid(10, 45, lam0)
+
+
+def test_long0_in_arc_seconds():
+    lam0 = 37 + 15/60 + 7/3600
+    grid = make_grid(10, 45, lam0)
+    assert grid.meridian(lam0 - 10) == [(x, -y) for x, y in grid.meridian(lam0 + 10)]
+    assert grid.meridian(lam0 + 180) == grid.meridian(lam0 - 180)
+
+
+class CountingProjector(pr.StereographicProjector):
+    def __init__(self, *args):
+        super(CountingProjector, self).__init__(*args)
+        self.projected = []
+
+    def project2plane(self, phi, lam, m=1):
+        self.projected.append((phi, lam))
+        return super(CountingProjector, self).project2plane(phi, lam, m)
+
+
+def test_points_are_projected_once():
+    projector = CountingProjector(IdentitySphere, 45, 30)
+    grid = pr.GridBuilder(projector, 7.5, 7.5, 45, 30)
+    grid.build()
+    # Only the antipode of the pole, which fails and so is not cached, is retried
+    repeated = [point for point, count in Counter(projector.projected).items() if count > 1]
+    assert repeated == [(-45, -150)]
+
+    projector = CountingProjector(IdentitySphere, 45, 30)
+    grid = pr.GridBuilder(projector, 1 / 3, 1 / 3, 45, 30)
+    points = grid.parallel(30)
+    assert len(projector.projected) == 361
+    for i in range(1000):
+        assert grid.parallel(90 * (1 / 3)) is points
+    assert len(projector.projected) == 361
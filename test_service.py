@@ -0,0 +1,124 @@
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import json
+
+import pytest
+
+import projection as pr
+import service
+
+
+KRASSOVSKY = (6378245.0, 6356863.01877305, 298.3, 1)
+POINTS = [(phi, lam) for phi in range(-70, 71, 20) for lam in range(-180, 180, 25)]
+
+
+def run_dispatch(method, path, params, executor=None):
+    async def dispatch(executor):
+        request = service.ProjectionService(executor).dispatch(method, path, json.dumps(params).encode())
+        return await asyncio.wait_for(request, timeout=10)
+
+    if executor is not None:
+        return asyncio.run(dispatch(executor))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return asyncio.run(dispatch(executor))
+
+
+@pytest.mark.parametrize('projection', sorted(service.SPHERE_PROJECTIONS))
+@pytest.mark.parametrize('phi0, lam0', [(45, 30), (-30, 170), (10, -175), (60, 180)])
+def test_forward_inverse_round_trip(projection, phi0, lam0):
+    key = (KRASSOVSKY, projection, float(phi0), float(lam0))
+    # The strip right at the antimeridian of lam0 is ambiguous for longitude
+    # scaling projections, there both sides are the same sphere point
+    points = [(phi, lam) for phi, lam in POINTS if abs(pr.norm_long(lam - lam0)) < 179]
+
+    planes = service.forward_batch(key, 1, points)
+    back = service.inverse_batch(key, 1, planes)
+
+    for (phi, lam), result in zip(points, back):
+        assert result[0] == pytest.approx(phi, abs=1e-9)
+        assert pr.norm_long(result[1] - lam) == pytest.approx(0, abs=1e-9)
+
+
+def test_gauss2_round_trip_across_antimeridian():
+    key = (KRASSOVSKY, 'gauss2', -30.0, 170.0)
+    (phi, lam), = service.inverse_batch(key, 1, service.forward_batch(key, 1, [(50, 40)]))
+    assert phi == pytest.approx(50, abs=1e-9)
+    assert lam == pytest.approx(40, abs=1e-9)
+
+
+def test_bad_point_does_not_fail_batch(monkeypatch):
+    key = (KRASSOVSKY, 'mollweide', 45.0, 30.0)
+    projector = service.get_projector(key)
+    project2plane = projector.project2plane
+    project2geographic = projector.project2geographic
+
+    def failing_project2plane(phi, lam, m=1):
+        if phi == 20:
+            raise ZeroDivisionError('float division by zero')
+        return project2plane(phi, lam, m)
+
+    def failing_project2geographic(x, y, m=1):
+        if x == 0:
+            raise OverflowError('math range error')
+        return project2geographic(x, y, m)
+
+    monkeypatch.setattr(projector, 'project2plane', failing_project2plane)
+    monkeypatch.setattr(projector, 'project2geographic', failing_project2geographic)
+
+    forward = service.forward_batch(key, 1, [(10, 40), (20, 40), (-45, 210)])
+    assert forward[0] is not None
+    assert forward[1] is None
+    assert forward[2] is None
+
+    inverse = service.inverse_batch(key, 1, [forward[0], (0.0, 1.0)])
+    assert inverse[0] == pytest.approx((10, 40))
+    assert inverse[1] is None
+
+
+@pytest.mark.parametrize('m', [None, 0, 'x', float('inf')])
+def test_invalid_scale_is_rejected(m):
+    params = {'ellipsoid': 'Krassovsky_1940', 'projection': 'mollweide', 'phi0': 45, 'lam0': 30,
+              'points': [[10, 40]], 'm': m}
+    status, payload = run_dispatch('POST', '/forward', params)
+    assert status == 400
+    assert '"m"' in payload['error']
+
+
+def test_forward_endpoint():
+    params = {'ellipsoid': 'Krassovsky_1940', 'projection': 'mollweide', 'phi0': 45, 'lam0': 30,
+              'points': [[10, 40], [45, 30]]}
+    status, payload = run_dispatch('POST', '/forward', params)
+    assert status == 200
+    assert payload['points'][1] == (0.0, 0.0)
+
+
+class BrokenExecutor(concurrent.futures.Executor):
+    def submit(self, fn, *args, **kwargs):
+        raise concurrent.futures.process.BrokenProcessPool('A worker process terminated abruptly')
+
+
+def test_broken_executor_fails_request():
+    params = {'ellipsoid': 'Krassovsky_1940', 'projection': 'mollweide', 'phi0': 45, 'lam0': 30,
+              'points': [[10, 40]]}
+    status, payload = run_dispatch('POST', '/forward', params, BrokenExecutor())
+    assert status == 500
+    assert 'BrokenProcessPool' in payload['error']
+
+
+@pytest.mark.parametrize('step_phi, step_lam', [(10, 0.1), (1 / 3600, 10), (0, 10), (10, float('inf')), (10, 'nan')])
+def test_grid_step_is_limited(step_phi, step_lam):
+    params = {'ellipsoid': 'Krassovsky_1940', 'projection': 'mollweide', 'phi0': 45, 'lam0': 30,
+              'step_phi': step_phi, 'step_lam': step_lam}
+    status, payload = run_dispatch('POST', '/grid', params, BrokenExecutor())
+    assert status == 400
+    assert 'Steps' in payload['error']
+
+
+def test_grid_endpoint():
+    params = {'ellipsoid': 'Krassovsky_1940', 'projection': 'mollweide', 'phi0': 45, 'lam0': 30,
+              'step_phi': 30, 'step_lam': 45}
+    status, payload = run_dispatch('POST', '/grid', params)
+    assert status == 200
+    assert [lat for lat, points in payload['parallels']] == [-60, -30, 0, 30, 60]
+    assert len(payload['meridians']) == 8
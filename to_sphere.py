@@ -1,6 +1,13 @@
+import json
+import os
 from math import sqrt, sin, radians, degrees, cos, tan
 
 
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+ELLIPSOIDS_PATH = os.path.join(DATA_PATH, 'Ellipsoids.ini')
+
+
 class EllipsoidHolder:
     def __init__(self, ellipsoid):
         self.a = float(ellipsoid['A'])
@@ -226,6 +233,51 @@ class EquidistantProjector:
         return degrees(rad_phi2), lam
 
 
+def inverse_project(projector, phi2, lam2, tolerance=1e-12, max_iterations=50):
+    # Every projector maps latitude alone and scales longitude linearly,
+    # and the latitude mapping is close to identity, so plain fixed-point
+    # iteration converges in a handful of steps
+    lam = lam2 / projector.project(0.0, 1.0)[1]
+    phi = phi2
+    for _ in range(max_iterations):
+        delta = phi2 - projector.project(phi, 0.0)[0]
+        phi += delta
+        if abs(delta) < tolerance:
+            break
+    return phi, lam
+
+
+def load_ellipsoids(path=ELLIPSOIDS_PATH):
+    # Parsed sections are cached as JSON and reparsed only when the ini changes
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    cache_path = os.path.join(CACHE_PATH, os.path.basename(path) + '.json')
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['path'] == path and cached['mtime'] == mtime:
+            return cached['ellipsoids']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import configparser
+
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(path, encoding='utf-8')
+    ellipsoids = {section: dict(config[section]) for section in config.sections()}
+
+    try:
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'path': path, 'mtime': mtime, 'ellipsoids': ellipsoids}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return ellipsoids
+
+
 def decdeg2dms(dd):
     is_positive = dd >= 0
     dd = abs(dd)
@@ -243,12 +295,8 @@ def dms_str(dd):
 
 
 if __name__ == '__main__':
-    import os
-    import configparser
-
-    config = configparser.ConfigParser()
-    config.read(os.path.join(os.path.dirname(__file__), r'data\Ellipsoids.ini'))
-    el = EllipsoidHolder(config['Krassovsky_1940'])
+    ellipsoids = load_ellipsoids()
+    el = EllipsoidHolder(ellipsoids['Krassovsky_1940'])
     mt = MollweideProjector(el)
 
     g1t = GaussFirstProjector(el, 0)